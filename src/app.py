@@ -1,12 +1,17 @@
 import os
+import re
+import sys
 import time
 import threading
 import queue
+import argparse
 import ctypes
 from ctypes import wintypes
 
+if os.name == "nt":
+    import winreg
+
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 
 # sorter.py에서 재사용할 것들 가져오기
 from sorter import (
@@ -14,10 +19,13 @@ from sorter import (
     ensure_dirs,
     log_line,
     safe_name,
-    bucket_for_ext,
     wait_until_ready,
+    DebouncedHandler,
     Statistics,
     History,
+    install_stop_handler,
+    run_until_stopped,
+    clock,
 )
 
 
@@ -26,9 +34,37 @@ from sorter import (
 # -----------------------------
 user32 = ctypes.windll.user32
 
+# 자주 부르는 함수들은 argtypes/restype을 한 번만 지정
+user32.GetForegroundWindow.argtypes = []
+user32.GetForegroundWindow.restype = wintypes.HWND
+user32.GetWindowTextW.argtypes = [wintypes.HWND, wintypes.LPWSTR, ctypes.c_int]
+user32.GetWindowTextW.restype = ctypes.c_int
+user32.MsgWaitForMultipleObjectsEx.argtypes = [
+    wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE), wintypes.DWORD, wintypes.DWORD, wintypes.DWORD,
+]
+user32.MsgWaitForMultipleObjectsEx.restype = wintypes.DWORD
+user32.PeekMessageW.argtypes = [ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT, wintypes.UINT]
+user32.PeekMessageW.restype = wintypes.BOOL
+
+# 핫키 스레드를 깨우기 위한 종료 이벤트(Win32 Event)
+kernel32 = ctypes.windll.kernel32
+kernel32.CreateEventW.argtypes = [wintypes.LPVOID, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR]
+kernel32.CreateEventW.restype = wintypes.HANDLE
+kernel32.SetEvent.argtypes = [wintypes.HANDLE]
+kernel32.SetEvent.restype = wintypes.BOOL
+kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+kernel32.CloseHandle.restype = wintypes.BOOL
+
+WM_QUIT = 0x0012
 WM_HOTKEY = 0x0312
+PM_REMOVE = 0x0001
+QS_ALLINPUT = 0x04FF
+MWMO_INPUTAVAILABLE = 0x0004
+INFINITE = 0xFFFFFFFF
+WAIT_OBJECT_0 = 0x00000000
 HOTKEY_ID = 1
 MOD_NOMOD = 0x0000
+MOD_NOREPEAT = 0x4000  # 키를 누르고 있어도 WM_HOTKEY는 한 번만
 
 # 핫키 매핑 (Function Keys)
 HOTKEY_VK_MAP = {
@@ -56,16 +92,16 @@ def get_hotkey_vk(hotkey_name: str) -> int:
     return HOTKEY_VK_MAP["F8"]
 
 
+# 창 제목용 버퍼 (핫키 스레드에서만 사용). 창 제목은 사실상 512자를 넘지 않음
+_TITLE_BUF_LEN = 512
+_title_buf = ctypes.create_unicode_buffer(_TITLE_BUF_LEN)
+
 def get_foreground_window_title() -> str:
     hwnd = user32.GetForegroundWindow()
     if not hwnd:
         return ""
-    length = user32.GetWindowTextLengthW(hwnd)
-    if length <= 0:
-        return ""
-    buf = ctypes.create_unicode_buffer(length + 1)
-    user32.GetWindowTextW(hwnd, buf, length + 1)
-    return buf.value or ""
+    n = user32.GetWindowTextW(hwnd, _title_buf, _TITLE_BUF_LEN)
+    return _title_buf.value if n > 0 else ""
 
 # -----------------------------
 # 작은 팝업(툴팁처럼) 표시용
@@ -80,14 +116,17 @@ class RECT(ctypes.Structure):
         ("bottom", wintypes.LONG),
     ]
 
+user32.GetWindowRect.argtypes = [wintypes.HWND, ctypes.POINTER(RECT)]
+user32.GetWindowRect.restype = wintypes.BOOL
+
 def get_foreground_hwnd() -> int:
-    return int(user32.GetForegroundWindow())
+    return user32.GetForegroundWindow() or 0
 
 def get_window_rect(hwnd: int) -> tuple[int, int, int, int] | None:
     if not hwnd:
         return None
     rect = RECT()
-    ok = user32.GetWindowRect(wintypes.HWND(hwnd), ctypes.byref(rect))
+    ok = user32.GetWindowRect(hwnd, ctypes.byref(rect))
     if not ok:
         return None
     return int(rect.left), int(rect.top), int(rect.right), int(rect.bottom)
@@ -99,34 +138,34 @@ def popup_worker():
     root = tk.Tk()
     root.withdraw()
 
-    def poll():
-        try:
-            while True:
-                text, x, y, ms = _popup_q.get_nowait()
-                win = tk.Toplevel(root)
-                win.overrideredirect(True)
-                win.attributes("-topmost", True)
+    def show(text: str, x: int, y: int, ms: int):
+        win = tk.Toplevel(root)
+        win.overrideredirect(True)
+        win.attributes("-topmost", True)
 
-                # 심플한 작은 박스
-                label = tk.Label(win, text=text, bg="black", fg="white", padx=10, pady=5)
-                label.pack()
+        # 심플한 작은 박스
+        label = tk.Label(win, text=text, bg="black", fg="white", padx=10, pady=5)
+        label.pack()
 
-                win.update_idletasks()
-                w = win.winfo_width()
-                h = win.winfo_height()
+        win.update_idletasks()
+        w = win.winfo_width()
+        h = win.winfo_height()
 
-                # 화면 밖으로 나가지 않게 약간 보정
-                px = max(0, x - (w // 2))
-                py = max(0, y)
-                win.geometry(f"{w}x{h}+{px}+{py}")
+        # 화면 밖으로 나가지 않게 약간 보정
+        px = max(0, x - (w // 2))
+        py = max(0, y)
+        win.geometry(f"{w}x{h}+{px}+{py}")
 
-                win.after(ms, win.destroy)
-        except queue.Empty:
-            pass
+        win.after(ms, win.destroy)
 
-        root.after(80, poll)
+    def feeder():
+        # 큐에 항목이 들어올 때만 깨어나서 Tk 스레드로 넘김 (주기적 polling 없음)
+        while True:
+            item = _popup_q.get()
+            root.after_idle(show, *item)
 
-    poll()
+    # mainloop가 돈 다음에 feeder를 시작 (다른 스레드의 Tk 호출은 mainloop가 필요)
+    root.after(0, lambda: threading.Thread(target=feeder, daemon=True).start())
     root.mainloop()
 
 def show_capture_popup(room: str):
@@ -141,57 +180,49 @@ def show_capture_popup(room: str):
     _popup_q.put((f"캡처됨: {room}", x, y, 900))
 
 
+_TITLE_SUFFIX_RE = re.compile(r"\s*-\s*(?:카카오톡|KakaoTalk)\s*$")
+_TITLE_LEFTOVER_RE = re.compile(r"카카오톡|KakaoTalk")
+
+
 def extract_room_from_title(title: str) -> str:
     """
     카카오톡 창 제목에서 채팅방 이름만 뽑아냅니다.
     일반적으로: "채팅방이름 - 카카오톡" 또는 "채팅방이름 - KakaoTalk"
     """
-    t = (title or "").strip()
-    if not t:
-        return "미분류"
-
-    # 흔한 접미사 제거
-    for suffix in [" - 카카오톡", " - KakaoTalk", "- 카카오톡", "- KakaoTalk"]:
-        if t.endswith(suffix):
-            t = t[: -len(suffix)].strip()
+    # 흔한 접미사(" - 카카오톡" 등) 제거
+    t = _TITLE_SUFFIX_RE.sub("", (title or "").strip(), count=1)
 
-    # 혹시 제목에 "카카오톡"만 남는 경우
-    t = t.replace("카카오톡", "").replace("KakaoTalk", "").strip()
-    if not t:
-        return "미분류"
+    # 혹시 제목에 "카카오톡"이 남는 경우
+    t = _TITLE_LEFTOVER_RE.sub("", t)
 
     # 파일/폴더 이름에 못 쓰는 문자 제거
-    t = safe_name(t)
-    return t if t else "미분류"
+    return safe_name(t) or "미분류"
 
 
 class Context:
     """
     F8을 눌렀을 때의 '채팅방 컨텍스트'를 메모리에 보관합니다.
+    (room, ts_str, ts_epoch)를 튜플 하나로 통째로 바꿔 끼우므로 읽을 때 락이 필요 없습니다.
     """
     def __init__(self):
-        self.lock = threading.Lock()
-        self.room = "미분류"
-        self.ts_str = time.strftime("%Y%m%d%H%M%S")
-        self.ts_epoch = 0.0  # 마지막 캡처 시각(epoch)
+        # ts_epoch: 마지막 캡처 시각(epoch), 0이면 아직 캡처 안 함
+        self._state: tuple[str, str, float] = ("미분류", clock.stamp(), 0.0)
 
     def set(self, room: str):
-        with self.lock:
-            self.room = room
-            self.ts_str = time.strftime("%Y%m%d%H%M%S")
-            self.ts_epoch = time.time()
+        now = time.time()
+        self._state = (room, clock.stamp(now), now)
 
     def get(self, ttl_seconds: int) -> tuple[str, str]:
-        with self.lock:
-            age = time.time() - self.ts_epoch
-            if self.ts_epoch > 0 and age <= ttl_seconds:
-                return self.room, self.ts_str
-        return "미분류", time.strftime("%Y%m%d%H%M%S")
+        room, ts_str, ts_epoch = self._state
+        if ts_epoch > 0 and time.time() - ts_epoch <= ttl_seconds:
+            return room, ts_str
+        return "미분류", clock.stamp()
 
 
-def hotkey_thread_fn(ctx: Context, stop_event: threading.Event, hotkey_name: str = "F8"):
+def hotkey_thread_fn(ctx: Context, stop_handle: int, hotkey_name: str = "F8"):
     """
     글로벌 핫키를 등록하고 메시지 루프를 돌립니다.
+    stop_handle(Win32 Event)이 신호 상태가 되면 바로 빠져나옵니다.
     """
     vk_code = get_hotkey_vk(hotkey_name)
 
@@ -201,27 +232,40 @@ def hotkey_thread_fn(ctx: Context, stop_event: threading.Event, hotkey_name: str
     except Exception:
         pass
 
-    if not user32.RegisterHotKey(None, HOTKEY_ID, MOD_NOMOD, vk_code):
+    if not user32.RegisterHotKey(None, HOTKEY_ID, MOD_NOMOD | MOD_NOREPEAT, vk_code):
         # 등록 실패 (다른 프로그램이 점유했거나 권한/환경 문제)
         print(f"ERROR: {hotkey_name} 핫키 등록 실패. 다른 프로그램에서 {hotkey_name}을 사용 중일 수 있어요.")
         print("      (config.json에서 다른 핫키로 변경할 수 있습니다: F1~F12)")
         return
 
     msg = wintypes.MSG()
-    while not stop_event.is_set():
-        # GetMessageW는 메시지가 올 때까지 대기합니다.
-        # WM_HOTKEY를 받으면 room 컨텍스트를 갱신합니다.
-        res = user32.GetMessageW(ctypes.byref(msg), None, 0, 0)
-        if res == 0:
-            break  # WM_QUIT
-        if msg.message == WM_HOTKEY and msg.wParam == HOTKEY_ID:
-            title = get_foreground_window_title()
-            room = extract_room_from_title(title)
-            ctx.set(room)
-            # 사용자 피드백(콘솔)
-            print(f"[F8] room captured: {room}")
-            show_capture_popup(room)
-
+    handles = (wintypes.HANDLE * 1)(stop_handle)
+    # 같은 창에서 여러 번 누르는 경우가 많아서 직전 제목 -> 채팅방 결과를 기억
+    last_title = None
+    last_room = None
+    running = True
+    while running:
+        # 메시지가 오거나 종료 이벤트가 신호 상태가 될 때까지 대기합니다.
+        rc = user32.MsgWaitForMultipleObjectsEx(1, handles, INFINITE, QS_ALLINPUT, MWMO_INPUTAVAILABLE)
+        if rc != WAIT_OBJECT_0 + 1:
+            break  # 종료 이벤트(WAIT_OBJECT_0) 또는 대기 실패
+
+        # 쌓인 메시지를 모두 꺼내고, WM_HOTKEY면 room 컨텍스트를 갱신합니다.
+        while user32.PeekMessageW(ctypes.byref(msg), None, 0, 0, PM_REMOVE):
+            if msg.message == WM_QUIT:
+                running = False
+                break
+            if msg.message == WM_HOTKEY and msg.wParam == HOTKEY_ID:
+                title = get_foreground_window_title()
+                if title == last_title:
+                    room = last_room
+                else:
+                    room = extract_room_from_title(title)
+                    last_title, last_room = title, room
+                ctx.set(room)
+                # 사용자 피드백(콘솔)
+                print(f"[F8] room captured: {room}")
+                show_capture_popup(room)
 
     user32.UnregisterHotKey(None, HOTKEY_ID)
 
@@ -229,10 +273,9 @@ def hotkey_thread_fn(ctx: Context, stop_event: threading.Event, hotkey_name: str
 # -----------------------------
 # 다운로드 폴더 감시 & 정리
 # -----------------------------
-class Handler(FileSystemEventHandler):
+class Handler(DebouncedHandler):
     def __init__(self, cfg, ctx: Context, stats=None, history=None):
-        super().__init__()
-        self.cfg = cfg
+        super().__init__(cfg)
         self.ctx = ctx
         self.stats = stats
         self.history = history
@@ -255,7 +298,7 @@ class Handler(FileSystemEventHandler):
             log_line(self.cfg, f"SKIP excluded extension: {src}")
             return
 
-        if not wait_until_ready(src):
+        if not wait_until_ready(src, self._ready_timeout()):
             log_line(self.cfg, f"SKIP not-ready: {src}")
             return
 
@@ -271,76 +314,7 @@ class Handler(FileSystemEventHandler):
             log_line(self.cfg, f"SKIP excluded room: {room}")
             return
 
-        bucket = bucket_for_ext(self.cfg, ext_l)
-        orig_safe = safe_name(name)
-
-        new_name = self.cfg.rename_template.format(
-            ts=ts, room=room, bucket=bucket, orig=orig_safe
-        )
-        new_name = safe_name(new_name)
-
-        dst_dir = os.path.join(self.cfg.output_dir, room, bucket)
-        os.makedirs(dst_dir, exist_ok=True)
-
-        dst = os.path.join(dst_dir, new_name)
-
-        # 중복 파일 처리
-        if os.path.exists(dst):
-            if self.cfg.duplicate_handling == "skip":
-                log_line(self.cfg, f"SKIP duplicate: {dst}")
-                return
-            elif self.cfg.duplicate_handling == "overwrite":
-                try:
-                    os.remove(dst)
-                    log_line(self.cfg, f"OVERWRITE: {dst}")
-                except Exception as e:
-                    log_line(self.cfg, f"FAIL overwrite: {dst} ({e})")
-                    return
-            else:  # rename (기본값)
-                base, e2 = os.path.splitext(dst)
-                i = 1
-                while os.path.exists(dst):
-                    dst = f"{base}({i}){e2}"
-                    i += 1
-
-        try:
-            # 파일 크기 얻기 (통계용)
-            file_size = 0
-            try:
-                file_size = os.path.getsize(src)
-            except Exception:
-                pass
-
-            import shutil
-            shutil.move(src, dst)
-            log_line(self.cfg, f"MOVED {src} -> {dst}")
-
-            # 통계 기록
-            if self.stats:
-                self.stats.record_file(room, bucket, file_size)
-
-            # 히스토리 기록
-            if self.history:
-                self.history.record_move(src, dst, room, bucket)
-
-        except Exception as ex:
-            log_line(self.cfg, f"FAIL move: {src} ({ex})")
-
-    def on_created(self, event):
-        if event.is_directory:
-            return
-        self._process_file(event.src_path)
-
-    def on_modified(self, event):
-        if event.is_directory:
-            return
-        self._process_file(event.src_path)
-
-    def on_moved(self, event):
-        if event.is_directory:
-            return
-        # 파일이 이동되어 들어온 경우 (dest_path가 감시 폴더 내)
-        self._process_file(event.dest_path)
+        self._move_to_output(src, name, ext_l, room, ts)
 
 
 # -----------------------------
@@ -348,7 +322,6 @@ class Handler(FileSystemEventHandler):
 # -----------------------------
 def get_exe_path() -> str:
     """현재 실행 파일의 절대 경로를 반환"""
-    import sys
     if getattr(sys, 'frozen', False):
         # PyInstaller로 빌드된 EXE
         return sys.executable
@@ -360,7 +333,6 @@ def get_exe_path() -> str:
 def enable_autorun() -> bool:
     """Windows 시작 시 자동 실행 활성화"""
     try:
-        import winreg
         exe_path = get_exe_path()
         key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
 
@@ -378,7 +350,6 @@ def enable_autorun() -> bool:
 def disable_autorun() -> bool:
     """Windows 시작 시 자동 실행 비활성화"""
     try:
-        import winreg
         key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
 
         with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, winreg.KEY_SET_VALUE) as key:
@@ -397,7 +368,6 @@ def disable_autorun() -> bool:
 def is_autorun_enabled() -> bool:
     """자동 실행 상태 확인"""
     try:
-        import winreg
         key_path = r"Software\Microsoft\Windows\CurrentVersion\Run"
 
         with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_path, 0, winreg.KEY_READ) as key:
@@ -413,6 +383,7 @@ def is_autorun_enabled() -> bool:
 def create_desktop_shortcut() -> bool:
     """바탕화면에 바로가기 생성"""
     try:
+        # --create-shortcut에서만 쓰므로 평소 실행 때는 pywin32를 불러오지 않음
         import win32com.client
         shell = win32com.client.Dispatch("WScript.Shell")
 
@@ -439,8 +410,6 @@ def create_desktop_shortcut() -> bool:
 
 
 def main():
-    import argparse
-
     parser = argparse.ArgumentParser(description="Kakao Download Organizer")
     parser.add_argument("--autorun-enable", action="store_true", help="Windows 시작 시 자동 실행 활성화")
     parser.add_argument("--autorun-disable", action="store_true", help="Windows 시작 시 자동 실행 비활성화")
@@ -481,6 +450,8 @@ def main():
 
     ctx = Context()
     stop_event = threading.Event()
+    install_stop_handler(stop_event)
+    stop_handle = kernel32.CreateEventW(None, True, False, None)
 
     # 통계 및 히스토리 초기화
     stats = Statistics(cfg) if cfg.enable_statistics else None
@@ -488,34 +459,34 @@ def main():
 
     # 핫키 스레드 시작
     threading.Thread(target=popup_worker, daemon=True).start()
-    t = threading.Thread(target=hotkey_thread_fn, args=(ctx, stop_event, cfg.hotkey), daemon=True)
+    t = threading.Thread(target=hotkey_thread_fn, args=(ctx, stop_handle, cfg.hotkey), daemon=True)
     t.start()
 
     # watchdog 시작
     obs = Observer()
-    obs.schedule(Handler(cfg, ctx, stats, history), cfg.download_dir, recursive=False)
+    handler = Handler(cfg, ctx, stats, history)
+    obs.schedule(handler, cfg.download_dir, recursive=False)
     obs.start()
 
     try:
-        # 주기적으로 통계 출력
-        last_stats_print = time.time()
-        while True:
-            time.sleep(5)
-
-            # 1시간마다 통계 출력
-            if stats and time.time() - last_stats_print > 3600:
-                print(stats.get_today_summary())
-                last_stats_print = time.time()
-
+        run_until_stopped(stop_event, stats)
     except KeyboardInterrupt:
         pass
     finally:
         stop_event.set()
+        kernel32.SetEvent(stop_handle)
+        # 핫키 스레드가 UnregisterHotKey까지 마치도록 잠깐 기다림
+        t.join(timeout=1)
+        kernel32.CloseHandle(stop_handle)
         obs.stop()
         obs.join()
+        handler.stop()
 
-        # 종료 시 최종 통계 출력
+        # 종료 시 남은 기록 저장 & 최종 통계 출력
+        if history:
+            history.close()
         if stats:
+            stats.close()
             print(stats.get_today_summary())
 
 
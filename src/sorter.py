@@ -1,24 +1,38 @@
 import json
 import sys
+import abc
+import atexit
+import errno
+import signal
 import os
 import ctypes
 from ctypes import wintypes
 
 import time
+import queue
 import shutil
+import string
+import threading
+import functools
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from datetime import datetime
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
 
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 
-def safe_name(s: str, max_len: int = 140) -> str:
-    bad = '\\/:*?"<>|'
-    for c in bad:
-        s = s.replace(c, "_")
-    s = s.strip()
-    return s[:max_len] if len(s) > max_len else s
+# 파일/폴더 이름에 못 쓰는 문자 -> "_"
+_BAD_CHARS = '\\/:*?"<>|'
+_BAD_CHARS_TABLE = str.maketrans({c: "_" for c in _BAD_CHARS})
+MAX_NAME_LEN = 140
+
+
+def safe_name(s: str, max_len: int = MAX_NAME_LEN) -> str:
+    # 자른 뒤 끝에 공백이 남지 않게 한 번 더 정리 (여러 번 불러도 결과가 같음)
+    s = s.translate(_BAD_CHARS_TABLE).strip()
+    return s[:max_len].rstrip()
 
 
 @dataclass
@@ -28,22 +42,75 @@ class Config:
     hotkey_context_ttl_seconds: int
     context_file: str
     rename_template: str
-    buckets: Dict[str, List[str]]
-    ignore_ext: List[str]
+    buckets: Dict[str, FrozenSet[str]]
+    ignore_ext: FrozenSet[str]
     log_dir: str
     # 새로운 설정들
     hotkey: str = "F8"
-    exclude_rooms: List[str] = None
-    exclude_extensions: List[str] = None
+    exclude_rooms: FrozenSet[str] = None
+    exclude_extensions: FrozenSet[str] = None
     duplicate_handling: str = "rename"  # rename, skip, overwrite
     enable_statistics: bool = True
     enable_history: bool = True
+    # download_dir와 output_dir이 같은 드라이브인지 (같으면 os.replace로 바로 이동)
+    same_volume: bool = True
+    # 확장자(소문자) -> 버킷 이름. 비어 있으면 buckets로부터 만듦
+    ext_to_bucket: Dict[str, str] = None
+    # rename_template을 미리 해석해 둔 함수. 비어 있으면 rename_template으로부터 만듦
+    render_name: Callable[..., str] = None
 
     def __post_init__(self):
         if self.exclude_rooms is None:
-            self.exclude_rooms = []
+            self.exclude_rooms = frozenset()
         if self.exclude_extensions is None:
-            self.exclude_extensions = []
+            self.exclude_extensions = frozenset()
+        if self.ext_to_bucket is None:
+            self.ext_to_bucket = build_ext_to_bucket(self.buckets)
+        if self.render_name is None:
+            self.render_name = compile_rename_template(self.rename_template)
+
+
+def build_ext_to_bucket(buckets: Dict[str, FrozenSet[str]]) -> Dict[str, str]:
+    """
+    버킷 설정을 "확장자 -> 버킷" 표로 뒤집습니다.
+    같은 확장자가 여러 버킷에 있으면 먼저 나온 버킷이 우선입니다.
+    """
+    table: Dict[str, str] = {}
+    for bucket, exts in buckets.items():
+        for e in exts:
+            table.setdefault(e.lower(), bucket)
+    return table
+
+
+def compile_rename_template(template: str) -> Callable[..., str]:
+    """
+    rename_template을 한 번만 해석해서, 글자 조각과 값을 이어 붙이기만 하는 함수로 만듭니다.
+    ({ts} 같은 단순 치환만 미리 조립하고, 서식 지정 등이 있으면 str.format_map으로 처리)
+    값({room}, {orig} 등)은 이미 safe_name으로 정리되어 들어오므로,
+    템플릿의 고정 글자에 파일 이름으로 못 쓰는 문자가 없으면 결과도 안전합니다.
+    (서식 지정/변환은 채움 문자나 !r의 역슬래시가 끼어들 수 있어 결과를 safe_name으로 한 번 더 정리)
+    """
+    parsed = list(string.Formatter().parse(template))
+    bad = sorted({c for literal, _, _, _ in parsed for c in literal if c in _BAD_CHARS})
+    if bad:
+        raise ValueError(
+            f"rename_template에 파일 이름으로 쓸 수 없는 문자가 있습니다: {''.join(bad)!r} ({template!r})"
+        )
+
+    if any(field is not None and (spec or conv or not field.isidentifier())
+           for _, field, spec, conv in parsed):
+        return lambda **values: safe_name(template.format_map(values))
+
+    parts: List[Tuple[str, str]] = [(literal, field) for literal, field, _, _ in parsed]
+
+    def render(**values: str) -> str:
+        return "".join(
+            literal if field is None else literal + values[field]
+            for literal, field in parts
+        )
+
+    return render
+
 
 class GUID(ctypes.Structure):
     _fields_ = [
@@ -62,19 +129,55 @@ FOLDERID_Downloads = GUID(
 )
 
 
+# Win32 상수 (파일 쓰기 완료 확인용 독점 열기, 워커 스레드 우선순위)
+GENERIC_READ = 0x80000000
+OPEN_EXISTING = 3
+FILE_ATTRIBUTE_NORMAL = 0x80
+ERROR_FILE_NOT_FOUND = 2
+ERROR_PATH_NOT_FOUND = 3
+ERROR_SHARING_VIOLATION = 32
+INVALID_HANDLE_VALUE = wintypes.HANDLE(-1).value
+THREAD_PRIORITY_LOWEST = -2
+CTRL_C_EVENT = 0
+CTRL_BREAK_EVENT = 1
+
+if os.name == "nt":
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateFileW.argtypes = [
+        wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+        wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE,
+    ]
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+    kernel32.CloseHandle.restype = wintypes.BOOL
+    kernel32.GetCurrentThread.argtypes = []
+    kernel32.GetCurrentThread.restype = wintypes.HANDLE
+    kernel32.SetThreadPriority.argtypes = [wintypes.HANDLE, ctypes.c_int]
+    kernel32.SetThreadPriority.restype = wintypes.BOOL
+    kernel32.SetConsoleCtrlHandler.argtypes = [ctypes.c_void_p, wintypes.BOOL]
+    kernel32.SetConsoleCtrlHandler.restype = wintypes.BOOL
+
+    SHGetKnownFolderPath = ctypes.windll.shell32.SHGetKnownFolderPath
+    SHGetKnownFolderPath.argtypes = [ctypes.POINTER(GUID), wintypes.DWORD, wintypes.HANDLE, ctypes.POINTER(ctypes.c_wchar_p)]
+    SHGetKnownFolderPath.restype = wintypes.HRESULT
+
+
 def get_known_folder_path(folder_id: GUID) -> str:
     """
     Windows가 실제로 사용하는 Known Folder 경로를 반환합니다.
     (문서/다운로드가 OneDrive로 리디렉션된 경우도 반영)
     """
+    # 실행 중에는 바뀌지 않으므로 GUID 바이트 기준으로 캐시
+    return _get_known_folder_path(bytes(folder_id))
+
+
+@functools.lru_cache(maxsize=8)
+def _get_known_folder_path(guid_bytes: bytes) -> str:
     # 비윈도우 환경 대비(안전장치)
     if os.name != "nt":
         return os.path.join(os.path.expandvars("%USERPROFILE%"), "Documents")
 
-    SHGetKnownFolderPath = ctypes.windll.shell32.SHGetKnownFolderPath
-    SHGetKnownFolderPath.argtypes = [ctypes.POINTER(GUID), wintypes.DWORD, wintypes.HANDLE, ctypes.POINTER(ctypes.c_wchar_p)]
-    SHGetKnownFolderPath.restype = wintypes.HRESULT
-
+    folder_id = GUID.from_buffer_copy(guid_bytes)
     p_path = ctypes.c_wchar_p()
     hr = SHGetKnownFolderPath(ctypes.byref(folder_id), 0, None, ctypes.byref(p_path))
     if hr != 0 or not p_path.value:
@@ -86,25 +189,40 @@ def get_known_folder_path(folder_id: GUID) -> str:
     return path
 
 
+def _list_subdirs(parent: str) -> set[str]:
+    """parent 바로 아래 폴더 이름들(normcase)을 scandir 한 번으로 가져옵니다."""
+    try:
+        with os.scandir(parent) as it:
+            return {os.path.normcase(e.name) for e in it if e.is_dir()}
+    except OSError:
+        return set()
+
+
+@functools.lru_cache(maxsize=1)
 def autodetect_kakaotalk_download_dir() -> str:
     """
     카카오톡 PC에서 흔히 쓰이는 기본 다운로드 폴더 후보를 찾아서
     '존재하는' 경로를 우선 반환합니다.
+    (후보마다 stat하지 않고 부모 폴더를 한 번씩만 훑음 - OneDrive 폴더에서 특히 느림)
     """
     docs = get_known_folder_path(FOLDERID_Documents)
     dls = get_known_folder_path(FOLDERID_Downloads)
 
+    # (부모 폴더, 폴더 이름) - 우선순위 순
     candidates = [
-        os.path.join(docs, "카카오톡 받은 파일"),
-        os.path.join(dls, "KakaoTalk Downloads"),
-        os.path.join(dls, "KakaoTalk"),
-        os.path.join(dls, "KakaoTalk", "Download"),
-        os.path.join(docs, "KakaoTalk Downloads"),
+        (docs, "카카오톡 받은 파일"),
+        (dls, "KakaoTalk Downloads"),
+        (dls, "KakaoTalk"),
+        (os.path.join(dls, "KakaoTalk"), "Download"),
+        (docs, "KakaoTalk Downloads"),
     ]
 
-    for p in candidates:
-        if os.path.isdir(p):
-            return p
+    listed: Dict[str, set[str]] = {}
+    for parent, name in candidates:
+        if parent not in listed:
+            listed[parent] = _list_subdirs(parent)
+        if os.path.normcase(name) in listed[parent]:
+            return os.path.join(parent, name)
 
     # 아무 후보도 없으면: 문서 아래 기본값으로(프로그램이 폴더 생성 가능)
     return os.path.join(docs, "카카오톡 받은 파일")
@@ -116,6 +234,10 @@ def autodetect_output_dir() -> str:
     return os.path.join(docs, "KakaoSorted")
 
 
+# 설정 파일 경로("" = 기본값) -> (st_mtime_ns, Config)
+_CFG_CACHE: Dict[str, Tuple[int, Config]] = {}
+
+
 def load_config() -> Config:
     """
     - 개발(소스) 실행: repo/config/config.json 사용
@@ -139,6 +261,21 @@ def load_config() -> Config:
         os.path.join(repo_dir, "config", "config.json"),
     ]
 
+    # 설정 파일이 그대로면(수정 시각 동일) 이전에 만든 Config를 재사용
+    config_path, mtime = None, None
+    for p in candidates:
+        try:
+            mtime = os.stat(p).st_mtime_ns
+        except OSError:
+            continue
+        config_path = p
+        break
+
+    cache_key = config_path or ""
+    cached = _CFG_CACHE.get(cache_key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
     # 2) 기본 설정(설정 파일이 없을 때 사용)
     default_raw = {
         "download_dir": "AUTO",
@@ -158,14 +295,10 @@ def load_config() -> Config:
     }
 
     # 3) 실제 설정 로드(있으면 읽고, 없으면 기본값)
-    raw = None
-    for p in candidates:
-        if os.path.exists(p):
-            with open(p, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-            break
-
-    if raw is None:
+    if config_path:
+        with open(config_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    else:
         raw = default_raw
 
     # 4) download/output 처리 (AUTO면 자동탐지, 아니면 환경변수 확장)
@@ -188,23 +321,39 @@ def load_config() -> Config:
     if getattr(sys, "frozen", False) and not os.path.isabs(log_dir):
         log_dir = os.path.join(os.path.dirname(sys.executable), log_dir)
 
-    return Config(
+    # 확장자는 소문자 frozenset으로 정규화해서 보관 (버킷 이름은 폴더/파일 이름에 쓰이므로 정리)
+    buckets = {
+        safe_name(str(b)): frozenset(e.lower() for e in exts)
+        for b, exts in raw.get("buckets", {}).items()
+    }
+
+    same_volume = (
+        os.path.splitdrive(os.path.abspath(download_dir))[0].lower()
+        == os.path.splitdrive(os.path.abspath(output_dir))[0].lower()
+    )
+
+    cfg = Config(
         download_dir=download_dir,
         output_dir=output_dir,
         hotkey_context_ttl_seconds=int(raw.get("hotkey_context_ttl_seconds", 180)),
         context_file=os.path.expandvars(raw.get("context_file", r"%TEMP%\kakao_room_ctx.txt")),
         rename_template=raw.get("rename_template", "{ts}__{room}__{bucket}__{orig}"),
-        buckets=raw.get("buckets", {}),
-        ignore_ext=[e.lower() for e in raw.get("ignore_ext", [])],
+        buckets=buckets,
+        ignore_ext=frozenset(e.lower() for e in raw.get("ignore_ext", [])),
         log_dir=log_dir,
         # 새로운 설정들
         hotkey=str(raw.get("hotkey", "F8")).upper(),
-        exclude_rooms=raw.get("exclude_rooms", []),
-        exclude_extensions=[e.lower() for e in raw.get("exclude_extensions", [])],
+        # 채팅방 이름은 폴더 이름과 같은 규칙으로 정리해서 비교
+        exclude_rooms=frozenset(safe_name(str(r)) for r in raw.get("exclude_rooms", [])),
+        exclude_extensions=frozenset(e.lower() for e in raw.get("exclude_extensions", [])),
         duplicate_handling=raw.get("duplicate_handling", "rename"),
         enable_statistics=bool(raw.get("enable_statistics", True)),
         enable_history=bool(raw.get("enable_history", True)),
+        same_volume=same_volume,
+        ext_to_bucket=build_ext_to_bucket(buckets),
     )
+    _CFG_CACHE[cache_key] = (mtime, cfg)
+    return cfg
 
 
 def ensure_dirs(cfg: Config) -> None:
@@ -213,46 +362,281 @@ def ensure_dirs(cfg: Config) -> None:
     os.makedirs(cfg.log_dir, exist_ok=True)
 
 
+class TimeCache:
+    """
+    time.strftime 대신 쓰는 현재 날짜/시각 문자열 캐시.
+    초가 바뀔 때만 localtime으로 날짜와 HH:MM:SS를 다시 만듭니다. (일광 절약 시간도 그대로 반영)
+    (상태를 튜플 하나로 바꿔 끼우므로 여러 스레드에서 락 없이 써도 됨)
+    """
+    def __init__(self):
+        # (초, "YYYY-MM-DD", "HH:MM:SS")
+        self._state = (-1, "", "")
+
+    def _get(self, now: float | None) -> tuple:
+        sec = int(time.time() if now is None else now)
+        state = self._state
+        if sec == state[0]:
+            return state
+
+        t = time.localtime(sec)
+        state = (
+            sec,
+            f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}",
+            f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}",
+        )
+        self._state = state
+        return state
+
+    def day(self, now: float | None = None) -> str:
+        """날짜 문자열(YYYY-MM-DD)"""
+        return self._get(now)[1]
+
+    def hms(self, now: float | None = None) -> str:
+        """시각 문자열(HH:MM:SS)"""
+        return self._get(now)[2]
+
+    def stamp(self, now: float | None = None) -> str:
+        """컨텍스트/파일명용 타임스탬프(YYYYMMDDHHMMSS)"""
+        state = self._get(now)
+        return state[1].replace("-", "") + state[2].replace(":", "")
+
+
+clock = TimeCache()
+
+
+# 로그는 큐에 넣기만 하고 전용 스레드가 파일에 씁니다.
+# (파일 이동 처리가 디스크 I/O를 기다리지 않도록, 로그 파일은 열어둔 채 재사용)
+_log_q: "queue.Queue[Tuple[float, str, str] | None]" = queue.Queue(maxsize=10000)
+_log_handle = None
+_log_key = None  # (log_dir, "YYYY-MM-DD"): 바뀌면 새 파일
+
+
+def _write_log(ts: float, log_dir: str, msg: str) -> None:
+    global _log_handle, _log_key
+    day = clock.day(ts)
+    key = (log_dir, day)
+    if key != _log_key:
+        if _log_handle:
+            _log_handle.close()
+            _log_handle = _log_key = None
+        path = os.path.join(log_dir, f"sorter_{day}.log")
+        _log_handle = open(path, "a", encoding="utf-8")
+        _log_key = key
+    _log_handle.write(f"[{clock.hms(ts)}] {msg}\n")
+
+
+def _log_writer() -> None:
+    running = True
+    while running:
+        # 하나가 올 때까지 기다린 뒤, 밀려 있는 것까지 한꺼번에 쓰고 flush는 한 번만
+        batch = [_log_q.get()]
+        while len(batch) < 500:
+            try:
+                batch.append(_log_q.get_nowait())
+            except queue.Empty:
+                break
+
+        for item in batch:
+            if item is None:
+                running = False
+                break
+            try:
+                _write_log(*item)
+            except Exception:
+                pass
+
+        if _log_handle:
+            try:
+                _log_handle.flush()
+            except Exception:
+                pass
+
+    if _log_handle:
+        _log_handle.close()
+
+
+_log_thread = threading.Thread(target=_log_writer, daemon=True)
+_log_thread.start()
+
+
+def _close_log() -> None:
+    # 남은 로그를 모두 쓰고 파일을 닫음
+    try:
+        _log_q.put(None, timeout=1)
+    except queue.Full:
+        return
+    _log_thread.join(timeout=2)
+
+
+atexit.register(_close_log)
+
+
 def log_line(cfg: Config, msg: str) -> None:
-    day = time.strftime("%Y-%m-%d")
-    path = os.path.join(cfg.log_dir, f"sorter_{day}.log")
-    line = f"[{time.strftime('%H:%M:%S')}] {msg}\n"
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(line)
+    try:
+        _log_q.put_nowait((time.time(), cfg.log_dir, msg))
+    except queue.Full:
+        # 로그가 밀릴 정도면 버림 (파일 정리가 로그 때문에 멈추지 않게)
+        pass
+
+
+class _BatchWriter(abc.ABC):
+    """
+    record_* 호출은 큐에 넣기만 하고, 전용 스레드가 모아서 한 번에 반영/저장합니다.
+    (파일 이동 처리가 JSON 저장을 기다리지 않도록. 저장은 최대 BATCH_WINDOW_SEC마다 한 번)
+    """
+    BATCH_WINDOW_SEC = 0.5
+
+    def _start_writer(self):
+        self._q: "queue.Queue[tuple | None]" = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        running = True
+        while running:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.BATCH_WINDOW_SEC
+            while batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    log_line(self.cfg, f"FAIL {type(self).__name__} write: {e}")
+
+    @abc.abstractmethod
+    def _write_batch(self, batch: list):
+        """모아진 기록 batch를 반영합니다. (기록 스레드에서 호출)"""
+
+    def _stop_writer(self, timeout: float = 5.0):
+        """남은 기록을 모두 반영할 때까지 기다립니다."""
+        self._q.put(None)
+        self._writer.join(timeout)
 
 
 # 통계 추적 클래스
-class Statistics:
+class Statistics(_BatchWriter):
+    """
+    기록은 statistics.jsonl에 한 줄씩 추가만 하고(append),
+    전체 statistics.json은 최대 COMPACT_INTERVAL_SEC마다 / 종료 시에만 다시 씁니다.
+    """
+    COMPACT_INTERVAL_SEC = 60
+    # 날짜별 통계 안에 "그날 마지막으로 반영된 저널 번호"를 적어 두는 키
+    # (statistics.json과 같은 파일에 있어야 저장/저널 비우기 사이에 꺼져도 중복 반영을 막을 수 있음)
+    SEQ_KEY = "journal_seq"
+
     def __init__(self, cfg: Config):
         self.cfg = cfg
         self.stats_file = os.path.join(cfg.log_dir, "statistics.json")
-        self.today = time.strftime("%Y-%m-%d")
+        self.journal_file = os.path.join(cfg.log_dir, "statistics.jsonl")
+        # 기록 스레드와 요약 출력(메인 스레드)이 동시에 건드리지 않도록 보호
+        self._lock = threading.Lock()
+        self._journal = None
+        # 마지막으로 저널에 쓴 기록 번호
+        self._seq = 0
+        self._last_compact = time.monotonic()
         self.stats = self._load_stats()
+        self._start_writer()
 
     def _load_stats(self) -> dict:
+        stats = {}
         if os.path.exists(self.stats_file):
             try:
                 with open(self.stats_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                    stats = json.load(f)
+            except Exception:
+                pass
+        if not isinstance(stats, dict):
+            stats = {}
+
+        # 지난번에 compact되지 못한 기록(비정상 종료 등)이 있으면 다시 반영
+        # (statistics.json 저장 후 저널을 비우기 전에 꺼졌다면 이미 반영된 번호는 건너뜀)
+        saved_seq = max(
+            (d.get(self.SEQ_KEY, 0) for d in stats.values() if isinstance(d, dict)),
+            default=0,
+        )
+        self._seq = saved_seq
+        replayed = False
+        if os.path.exists(self.journal_file):
+            try:
+                with open(self.journal_file, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            e = json.loads(line)
+                            seq = e.get("seq")
+                            if seq is not None:
+                                self._seq = max(self._seq, seq)
+                                if seq <= saved_seq:
+                                    continue
+                            self._apply(stats, e["day"], e["room"], e["bucket"], e["size"])
+                            if seq is not None:
+                                stats[e["day"]][self.SEQ_KEY] = seq
+                            replayed = True
+                        except Exception:
+                            pass
             except Exception:
                 pass
-        return {}
 
-    def _save_stats(self):
+        if replayed:
+            self.stats = stats
+            self._compact()
+        return stats
+
+    def _save_stats(self) -> bool:
+        """
+        임시 파일에 쓴 뒤 os.replace로 바꿔치기합니다. (쓰다가 꺼져도 기존 파일은 그대로)
+        성공하면 True를 반환합니다.
+        """
+        tmp = self.stats_file + ".tmp"
         try:
-            with open(self.stats_file, "w", encoding="utf-8") as f:
+            with open(tmp, "w", encoding="utf-8") as f:
                 json.dump(self.stats, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.stats_file)
+            return True
         except Exception as e:
             log_line(self.cfg, f"Failed to save stats: {e}")
+            return False
 
-    def record_file(self, room: str, bucket: str, file_size: int):
-        if not self.cfg.enable_statistics:
-            return
+    def _compact(self):
+        """전체 통계를 statistics.json에 쓰고, 저장에 성공했을 때만 저널을 비웁니다."""
+        self._last_compact = time.monotonic()
+        if not self._save_stats():
+            return  # 저널이 유일한 기록이므로 남겨 둠
+        try:
+            if self._journal:
+                self._journal.seek(0)
+                self._journal.truncate()
+            else:
+                open(self.journal_file, "w", encoding="utf-8").close()
+        except Exception as e:
+            log_line(self.cfg, f"Failed to truncate stats journal: {e}")
 
-        if self.today not in self.stats:
-            self.stats[self.today] = {}
+    def _append_journal(self, entry: dict):
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_file, "a", encoding="utf-8")
+            self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception as e:
+            log_line(self.cfg, f"Failed to write stats journal: {e}")
 
-        day_stats = self.stats[self.today]
+    @staticmethod
+    def _apply(stats: dict, day: str, room: str, bucket: str, file_size: int):
+        if day not in stats:
+            stats[day] = {}
+
+        day_stats = stats[day]
 
         # 전체 통계
         if "total" not in day_stats:
@@ -276,57 +660,96 @@ class Statistics:
         day_stats["by_room"][room]["count"] += 1
         day_stats["by_room"][room]["size"] += file_size
 
-        self._save_stats()
+    def record_file(self, room: str, bucket: str, file_size: int):
+        if not self.cfg.enable_statistics:
+            return
+
+        self._q.put_nowait((clock.day(), room, bucket, file_size))
+
+    def _write_batch(self, batch: list):
+        with self._lock:
+            for day, room, bucket, file_size in batch:
+                self._apply(self.stats, day, room, bucket, file_size)
+                self._seq += 1
+                self.stats[day][self.SEQ_KEY] = self._seq
+                self._append_journal(
+                    {"seq": self._seq, "day": day, "room": room, "bucket": bucket, "size": file_size}
+                )
+            if self._journal:
+                self._journal.flush()
+
+            if time.monotonic() - self._last_compact >= self.COMPACT_INTERVAL_SEC:
+                self._compact()
+
+    def close(self):
+        """종료 시 호출: 남은 기록을 반영하고 전체 통계를 저장한 뒤 저널을 비우고 닫습니다."""
+        self._stop_writer()
+        with self._lock:
+            self._compact()
+            if self._journal:
+                self._journal.close()
+                self._journal = None
 
     def get_today_summary(self) -> str:
-        if self.today not in self.stats:
-            return "오늘 정리된 파일: 0개"
+        today = clock.day()
+        with self._lock:
+            if today not in self.stats:
+                return "오늘 정리된 파일: 0개"
 
-        day_stats = self.stats[self.today]
-        total = day_stats.get("total", {"count": 0, "size": 0})
-        count = total["count"]
-        size_mb = total["size"] / (1024 * 1024)
+            day_stats = self.stats[today]
+            total = day_stats.get("total", {"count": 0, "size": 0})
+            count = total["count"]
+            size_mb = total["size"] / (1024 * 1024)
 
-        lines = [f"\n📊 오늘 정리된 파일: {count}개 ({size_mb:.1f}MB)"]
+            lines = [f"\n📊 오늘 정리된 파일: {count}개 ({size_mb:.1f}MB)"]
 
-        by_bucket = day_stats.get("by_bucket", {})
-        if by_bucket:
-            lines.append("  종류별:")
-            for bucket, data in by_bucket.items():
-                bcount = data["count"]
-                bsize = data["size"] / (1024 * 1024)
-                lines.append(f"    {bucket}: {bcount}개 ({bsize:.1f}MB)")
+            by_bucket = day_stats.get("by_bucket", {})
+            if by_bucket:
+                lines.append("  종류별:")
+                for bucket, data in by_bucket.items():
+                    bcount = data["count"]
+                    bsize = data["size"] / (1024 * 1024)
+                    lines.append(f"    {bucket}: {bcount}개 ({bsize:.1f}MB)")
 
-        return "\n".join(lines)
+            return "\n".join(lines)
 
 
 # 히스토리 추적 클래스
-class History:
+class History(_BatchWriter):
+    HISTORY_KEEP_DAYS = 30
+
     def __init__(self, cfg: Config):
         self.cfg = cfg
         self.history_file = os.path.join(cfg.log_dir, "history.json")
-        self.today = time.strftime("%Y-%m-%d")
+        # 기록 스레드와 종료 처리가 동시에 건드리지 않도록 보호
+        self._lock = threading.Lock()
+        # 불러올 때 정리된(지워진) 날짜가 있으면 종료 때 파일에도 반영
+        self._pruned_at_load = False
         self.history = self._load_history()
+        self._start_writer()
 
     def _load_history(self) -> dict:
         if os.path.exists(self.history_file):
             try:
                 with open(self.history_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                    loaded = json.load(f)
+                history = self._prune(loaded)
+                self._pruned_at_load = len(history) != len(loaded)
+                return history
             except Exception:
                 pass
         return {}
 
+    def _prune(self, history: dict) -> dict:
+        """최근 HISTORY_KEEP_DAYS일만 남깁니다. (매 기록마다가 아니라 시작/종료 때만 정리)"""
+        cutoff = time.time() - (self.HISTORY_KEEP_DAYS * 24 * 60 * 60)
+        cutoff_date = time.strftime("%Y-%m-%d", time.localtime(cutoff))
+        return {k: v for k, v in history.items() if k >= cutoff_date}
+
     def _save_history(self):
         try:
-            # 최근 30일만 보관
-            cutoff = time.time() - (30 * 24 * 60 * 60)
-            cutoff_date = time.strftime("%Y-%m-%d", time.localtime(cutoff))
-
-            filtered = {k: v for k, v in self.history.items() if k >= cutoff_date}
-
             with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump(filtered, f, ensure_ascii=False, indent=2)
+                json.dump(self.history, f, ensure_ascii=False, indent=2)
         except Exception as e:
             log_line(self.cfg, f"Failed to save history: {e}")
 
@@ -334,49 +757,68 @@ class History:
         if not self.cfg.enable_history:
             return
 
-        if self.today not in self.history:
-            self.history[self.today] = []
-
-        self.history[self.today].append({
-            "time": time.strftime("%H:%M:%S"),
+        now = time.time()
+        self._q.put_nowait((clock.day(now), {
+            "time": clock.hms(now),
             "src": src,
             "dst": dst,
             "room": room,
             "bucket": bucket
-        })
+        }))
 
-        self._save_history()
+    def _write_batch(self, batch: list):
+        with self._lock:
+            for day, entry in batch:
+                self.history.setdefault(day, []).append(entry)
+            self._save_history()
 
+    def close(self):
+        """종료 시 호출: 남은 기록을 반영하고, HISTORY_KEEP_DAYS일이 지난 기록을 정리해서 저장합니다."""
+        self._stop_writer()
+        with self._lock:
+            pruned = self._prune(self.history)
+            if self._pruned_at_load or len(pruned) != len(self.history):
+                self.history = pruned
+                self._save_history()
 
-def get_room_context(cfg: Config) -> Tuple[str, str]:
-    try:
-        with open(cfg.context_file, "r", encoding="utf-8") as f:
-            raw = f.read().strip()
-        room, ts = raw.split("|", 1)
-
-        t_struct = time.strptime(ts, "%Y%m%d%H%M%S")
-        age = time.time() - time.mktime(t_struct)
 
-        if age <= cfg.hotkey_context_ttl_seconds:
-            return room, ts
-    except Exception:
-        pass
+def read_room_context(path: str, ttl_seconds: int) -> Tuple[str, str, float]:
+    """
+    AHK가 쓴 컨텍스트 파일("채팅방|YYYYMMDDHHMMSS")을 읽어
+    (room, ts, 만료 시각 epoch)을 반환합니다. 형식이 틀리면 예외가 납니다.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read().strip()
+    room, ts = raw.split("|", 1)
 
-    return "미분류", time.strftime("%Y%m%d%H%M%S")
+    # 고정 14자리라 strptime 대신 직접 잘라서 파싱 (로컬 시각 기준)
+    if len(ts) != 14 or not ts.isdigit():
+        raise ValueError(f"bad context timestamp: {ts!r}")
+    captured = datetime(
+        int(ts[0:4]), int(ts[4:6]), int(ts[6:8]),
+        int(ts[8:10]), int(ts[10:12]), int(ts[12:14]),
+    ).timestamp()
+    return room, ts, captured + ttl_seconds
 
 
 def bucket_for_ext(cfg: Config, ext: str) -> str:
-    e = ext.lower()
-    for bucket, exts in cfg.buckets.items():
-        if e in [x.lower() for x in exts]:
-            return bucket
-    return "기타"
+    return cfg.ext_to_bucket.get(ext.lower(), "기타")
+
 
+# 마지막 수정 후 이만큼(초) 지난 파일은 쓰기가 끝난 것으로 봄
+READY_MTIME_AGE_SEC = 2.0
+READY_TIMEOUT_SEC = 20
+# 종료 중에는 아직 다운로드 중인 파일을 오래 기다리지 않음
+STOP_READY_TIMEOUT_SEC = 1
+STOP_JOIN_TIMEOUT_SEC = 10.0
 
-def wait_until_ready(path: str, timeout_sec: int = 20) -> bool:
+
+def _wait_until_size_stable(path: str, timeout_sec: int) -> bool:
+    # 50ms에서 시작해서 1.3배씩 늘림(최대 0.5초). 크기가 바뀌면(아직 쓰는 중) 다시 짧게
     start = time.time()
     last_size = -1
     stable = 0
+    delay = 0.05
 
     while time.time() - start < timeout_sec:
         try:
@@ -385,126 +827,461 @@ def wait_until_ready(path: str, timeout_sec: int = 20) -> bool:
                 stable += 1
             else:
                 stable = 0
+                delay = 0.05
             last_size = size
 
-            if stable >= 3:
+            if stable >= 2:
                 with open(path, "rb"):
                     return True
         except Exception:
             pass
-        time.sleep(0.2)
+        time.sleep(delay)
+        delay = min(delay * 1.3, 0.5)
 
     return False
 
 
-class Handler(FileSystemEventHandler):
-    def __init__(self, cfg: Config, stats: Statistics = None, history: History = None):
-        super().__init__()
-        self.cfg = cfg
-        self.stats = stats
-        self.history = history
+def _try_exclusive_open(path: str) -> int:
+    """
+    공유 없이(dwShareMode=0) 파일을 열어봅니다.
+    성공하면 0, 실패하면 Win32 에러 코드를 반환합니다.
+    """
+    h = kernel32.CreateFileW(path, GENERIC_READ, 0, None, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, None)
+    if h is None or h == INVALID_HANDLE_VALUE:
+        return ctypes.get_last_error()
+    kernel32.CloseHandle(h)
+    return 0
 
-    def _process_file(self, src: str):
-        """공통 파일 처리 로직"""
-        if not os.path.exists(src):
-            return
 
-        name = os.path.basename(src)
-        _, ext = os.path.splitext(name)
-        ext_l = ext.lower()
+def wait_until_ready(path: str, timeout_sec: int = READY_TIMEOUT_SEC) -> bool:
+    """
+    파일 쓰기가 끝나서 옮겨도 되는 상태가 될 때까지 기다립니다.
+    - Windows: 독점 열기를 시도하고, 아직 쓰는 중(공유 위반)이면 5ms부터 두 배씩 늘려가며 재시도
+    - 그 외: 파일 크기가 몇 번 연속 같은지 확인
+    """
+    # 이벤트 시점에 이미 한동안 안 바뀐 파일이면(작은 이미지 등) 바로 통과
+    try:
+        st = os.stat(path)
+        if st.st_size > 0 and time.time() - st.st_mtime > READY_MTIME_AGE_SEC:
+            return True
+    except FileNotFoundError:
+        return False
+    except OSError:
+        pass
 
-        # 무시할 확장자 체크
-        if ext_l in self.cfg.ignore_ext:
-            return
+    if os.name != "nt":
+        return _wait_until_size_stable(path, timeout_sec)
 
-        # 제외할 확장자 체크
-        if ext_l in self.cfg.exclude_extensions:
-            log_line(self.cfg, f"SKIP excluded extension: {src}")
-            return
+    deadline = time.monotonic() + timeout_sec
+    delay = 0.005
 
-        if not wait_until_ready(src):
-            log_line(self.cfg, f"SKIP not-ready: {src}")
-            return
+    while True:
+        err = _try_exclusive_open(path)
+        if err == 0:
+            try:
+                if os.path.getsize(path) > 0:
+                    return True
+            except OSError:
+                return False
+        elif err in (ERROR_FILE_NOT_FOUND, ERROR_PATH_NOT_FOUND):
+            return False
 
-        room, ts = get_room_context(self.cfg)
-        ts = ts[:12]  # YYYYMMDDHHMM (초 제거)
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
 
-        room = safe_name(room)
 
-        # 제외할 채팅방 체크
-        if room in self.cfg.exclude_rooms:
-            log_line(self.cfg, f"SKIP excluded room: {room}")
+def reserve_unique_path(dst: str, start: int = 0) -> Tuple[str, int]:
+    """
+    dst 자리에 빈 파일을 O_EXCL로 만들어 이름을 선점하고 (경로, 번호)를 반환합니다.
+    이미 있으면 "이름(1).확장자", "이름(2).확장자" ... 순서로 시도합니다. (번호 0 = 원래 이름)
+    (exists 확인 후 이동하는 방식과 달리, 동시에 들어온 파일끼리 같은 이름을 쓰지 않음)
+    """
+    base, ext = os.path.splitext(dst)
+    i = start
+    while True:
+        path = f"{base}({i}){ext}" if i else dst
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+        except FileExistsError:
+            i += 1
+            continue
+        os.close(fd)
+        return path, i
+
+
+def move_file(src: str, dst: str, same_volume: bool = True) -> None:
+    """
+    src를 dst로 옮깁니다(dst가 있으면 덮어씀).
+    같은 드라이브면 os.replace 한 번으로 끝나고, 다른 드라이브면 shutil.move로 복사합니다.
+    """
+    if same_volume:
+        try:
+            os.replace(src, dst)
             return
+        except OSError as e:
+            # 드라이브 문자가 같아도 마운트 지점 등으로 볼륨이 다를 수 있음 (ERROR_NOT_SAME_DEVICE)
+            # 그 외(잠김, 권한 등)는 복사로 넘어가면 중복 파일만 남으므로 그대로 올림
+            if e.errno != errno.EXDEV:
+                raise
+    shutil.move(src, dst)
+
 
+# 최근 처리 기록 보관 개수/시간
+RECENT_MAX = 512
+RECENT_TTL_SEC = 60.0
+
+
+class DebouncedHandler(FileSystemEventHandler, metaclass=abc.ABCMeta):
+    """
+    watchdog 이벤트를 경로별로 모아두었다가, debounce_sec 동안 추가 이벤트가 없으면
+    그 경로에 대해 _process_file을 한 번만 호출합니다.
+    (다운로드 한 번에 created/modified 이벤트가 여러 번 오는 것을 하나로 합침)
+    처리는 workers개의 워커 스레드가 나눠서 합니다.
+    """
+    def __init__(self, cfg: Config, debounce_sec: float = 0.4, workers: int = 3):
+        super().__init__()
+        self.cfg = cfg
+        self.debounce_sec = debounce_sec
+        # path -> 처리 예정 시각(monotonic). 갱신 시 맨 뒤로 보내므로 항상 시각 순서로 정렬됨
+        self._pending: "OrderedDict[str, float]" = OrderedDict()
+        self._cond = threading.Condition()
+        # 워커가 지금 처리 중인 경로
+        self._inflight: set[str] = set()
+        # 처리 중에 modified 이벤트가 또 온 경로 (처리가 실패하면 다시 예약)
+        self._dirty: set[str] = set()
+        # 이미 만들어 둔 출력 폴더 (매 파일마다 makedirs를 부르지 않도록)
+        self._dir_cache: set[str] = set()
+        self._cache_lock = threading.Lock()
+        # 대상 경로 -> 다음에 시도할 중복 번호 (같은 이름이 몰릴 때 (1)부터 다시 훑지 않도록)
+        self._name_index: Dict[str, int] = {}
+        # 최근에 옮겨진 경로 -> 처리 시각(monotonic). 뒤늦게 온 modified 이벤트를 무시하는 용도
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+        # 옮긴 결과를 기록할 곳 (하위 클래스에서 지정, 없으면 기록 안 함)
+        self.stats: Optional[Statistics] = None
+        self.history: Optional[History] = None
+        # stop() 이후에는 처리 시각을 기다리지 않고 남은 경로를 바로 처리한 뒤 워커 종료
+        self._stopping = False
+        # 여러 워커가 파일 준비 대기(wait_until_ready)를 겹쳐서 기다림
+        self._workers = [
+            threading.Thread(target=self._worker_loop, daemon=True) for _ in range(workers)
+        ]
+        for t in self._workers:
+            t.start()
+
+    def _schedule(self, path: str, new_file: bool = True):
+        with self._cond:
+            now = time.monotonic()
+            # 오래된 기록은 앞에서부터 정리
+            while self._recent and next(iter(self._recent.values())) < now - RECENT_TTL_SEC:
+                self._recent.popitem(last=False)
+
+            if new_file:
+                # 같은 이름으로 새 파일이 들어온 경우이므로 기록을 지움
+                self._recent.pop(path, None)
+            elif path in self._recent:
+                # 이미 처리한 파일
+                return
+            elif path in self._inflight:
+                # 워커가 wait_until_ready로 기다리는 중: 표시만 해 두고 _finish에서 판단
+                self._dirty.add(path)
+                return
+
+            self._pending[path] = now + self.debounce_sec
+            self._pending.move_to_end(path)
+            self._cond.notify()
+
+    def _pop_next(self) -> str:
+        """
+        처리 시각이 지난 경로 하나를 꺼냅니다. 없으면 가장 가까운 시각까지 대기합니다.
+        다른 워커가 처리 중인 경로는 끝날 때까지 건너뜁니다.
+        stop() 이후 남은 경로가 없으면 None을 반환합니다.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                timeout = None
+                for path, deadline in self._pending.items():
+                    if path in self._inflight:
+                        continue
+                    if deadline <= now or self._stopping:
+                        del self._pending[path]
+                        self._inflight.add(path)
+                        return path
+                    timeout = deadline - now
+                    break
+                if self._stopping and not self._pending:
+                    return None
+                self._cond.wait(timeout)
+
+    def _worker_loop(self):
+        if os.name == "nt":
+            # 파일 정리는 급하지 않으니 다른 작업(카톡 등)에 CPU를 양보
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_PRIORITY_LOWEST)
+
+        while True:
+            path = self._pop_next()
+            if path is None:
+                return
+            try:
+                self._process_file(path)
+            except Exception as ex:
+                log_line(self.cfg, f"FAIL process: {path} ({ex})")
+            self._finish(path, done=not os.path.exists(path))
+
+    def stop(self, timeout: float = STOP_JOIN_TIMEOUT_SEC):
+        """
+        종료 시 호출(obs.join() 다음): debounce 대기 중인 경로까지 처리하고
+        진행 중인 이동이 끝날 때까지 워커를 기다립니다. (최대 timeout초)
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._workers:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    def _ready_timeout(self) -> int:
+        """wait_until_ready에 넘길 대기 시간 (종료 중에는 짧게)"""
+        return STOP_READY_TIMEOUT_SEC if self._stopping else READY_TIMEOUT_SEC
+
+    def _finish(self, path: str, done: bool):
+        with self._cond:
+            self._inflight.discard(path)
+            if path in self._dirty:
+                self._dirty.discard(path)
+                if not done and not self._stopping and path not in self._pending:
+                    # 대기 중에 쓰기가 더 있었는데 옮기지 못함 -> 다시 예약
+                    self._pending[path] = time.monotonic() + self.debounce_sec
+            if done:
+                self._recent[path] = time.monotonic()
+                self._recent.move_to_end(path)
+                if len(self._recent) > RECENT_MAX:
+                    self._recent.popitem(last=False)
+            self._cond.notify_all()
+
+    def _ensure_dir(self, path: str):
+        with self._cache_lock:
+            if path in self._dir_cache:
+                return
+        os.makedirs(path, exist_ok=True)
+        with self._cache_lock:
+            if len(self._dir_cache) >= 256:
+                self._dir_cache.clear()
+            self._dir_cache.add(path)
+
+    def _reserve(self, dst: str) -> str:
+        with self._cache_lock:
+            start = self._name_index.get(dst, 0)
+        path, i = reserve_unique_path(dst, start)
+        with self._cache_lock:
+            if len(self._name_index) >= 256:
+                self._name_index.clear()
+            self._name_index[dst] = max(self._name_index.get(dst, 0), i + 1)
+        return path
+
+    def _in_dir(self, dst_dir: str, fn: Callable, *args):
+        """
+        dst_dir 안에 쓰는 작업 fn(*args)를 실행합니다.
+        실행 중에 사용자가 폴더를 지워 FileNotFoundError가 나면
+        캐시에서 빼고 폴더를 다시 만든 뒤 한 번만 더 시도합니다.
+        """
+        try:
+            return fn(*args)
+        except FileNotFoundError:
+            with self._cache_lock:
+                self._dir_cache.discard(dst_dir)
+            self._ensure_dir(dst_dir)
+            return fn(*args)
+
+    def _move_to_output(self, src: str, name: str, ext_l: str, room: str, ts: str):
+        """
+        정리된 room/ts로 새 이름과 대상 경로를 정하고, 중복 처리 후 옮긴 뒤
+        통계/히스토리에 기록합니다. (두 Handler의 _process_file 공통 뒷부분)
+        """
         bucket = bucket_for_ext(self.cfg, ext_l)
         orig_safe = safe_name(name)
 
-        new_name = self.cfg.rename_template.format(
+        # room/orig/bucket은 이미 정리되어 있고 템플릿은 로드 때 검사했으므로 길이만 맞춤
+        new_name = self.cfg.render_name(
             ts=ts, room=room, bucket=bucket, orig=orig_safe
-        )
-        new_name = safe_name(new_name)
+        )[:MAX_NAME_LEN].rstrip()
 
         dst_dir = os.path.join(self.cfg.output_dir, room, bucket)
-        os.makedirs(dst_dir, exist_ok=True)
+        self._ensure_dir(dst_dir)
 
         dst = os.path.join(dst_dir, new_name)
 
         # 중복 파일 처리
-        if os.path.exists(dst):
-            if self.cfg.duplicate_handling == "skip":
+        reserved = False
+        if self.cfg.duplicate_handling == "skip":
+            if os.path.exists(dst):
                 log_line(self.cfg, f"SKIP duplicate: {dst}")
                 return
-            elif self.cfg.duplicate_handling == "overwrite":
+        elif self.cfg.duplicate_handling == "overwrite":
+            if os.path.exists(dst):
                 try:
                     os.remove(dst)
                     log_line(self.cfg, f"OVERWRITE: {dst}")
                 except Exception as e:
                     log_line(self.cfg, f"FAIL overwrite: {dst} ({e})")
                     return
-            else:  # rename (기본값)
-                base, e2 = os.path.splitext(dst)
-                i = 1
-                while os.path.exists(dst):
-                    dst = f"{base}({i}){e2}"
-                    i += 1
+        else:  # rename (기본값): 빈 파일로 이름을 먼저 선점
+            try:
+                dst = self._in_dir(dst_dir, self._reserve, dst)
+                reserved = True
+            except OSError as e:
+                log_line(self.cfg, f"FAIL reserve: {dst} ({e})")
+                return
 
+        # 파일 크기 얻기 (통계용)
+        file_size = 0
         try:
-            # 파일 크기 얻기 (통계용)
-            file_size = 0
-            try:
-                file_size = os.path.getsize(src)
-            except Exception:
-                pass
+            file_size = os.path.getsize(src)
+        except Exception:
+            pass
 
-            shutil.move(src, dst)
-            log_line(self.cfg, f"MOVED {src} -> {dst}")
+        try:
+            self._in_dir(dst_dir, move_file, src, dst, self.cfg.same_volume)
+        except Exception as ex:
+            log_line(self.cfg, f"FAIL move: {src} ({ex})")
+            if reserved:
+                # 선점해 둔 빈 파일 정리
+                try:
+                    os.remove(dst)
+                except OSError:
+                    pass
+            return
 
-            # 통계 기록
-            if self.stats:
-                self.stats.record_file(room, bucket, file_size)
+        log_line(self.cfg, f"MOVED {src} -> {dst}")
 
-            # 히스토리 기록
-            if self.history:
-                self.history.record_move(src, dst, room, bucket)
+        # 통계 기록
+        if self.stats:
+            self.stats.record_file(room, bucket, file_size)
 
-        except Exception as ex:
-            log_line(self.cfg, f"FAIL move: {src} ({ex})")
+        # 히스토리 기록
+        if self.history:
+            self.history.record_move(src, dst, room, bucket)
+
+    @abc.abstractmethod
+    def _process_file(self, src: str):
+        """경로 하나를 처리합니다. (워커 스레드에서 호출)"""
 
     def on_created(self, event):
         if event.is_directory:
             return
-        self._process_file(event.src_path)
+        self._schedule(event.src_path)
 
     def on_modified(self, event):
         if event.is_directory:
             return
-        self._process_file(event.src_path)
+        self._schedule(event.src_path, new_file=False)
 
     def on_moved(self, event):
         if event.is_directory:
             return
         # 파일이 이동되어 들어온 경우 (dest_path가 감시 폴더 내)
-        self._process_file(event.dest_path)
+        self._schedule(event.dest_path)
+
+
+class Handler(DebouncedHandler):
+    def __init__(self, cfg: Config, stats: Statistics = None, history: History = None):
+        super().__init__(cfg)
+        self.stats = stats
+        self.history = history
+        # 컨텍스트 파일 캐시: (st_mtime_ns, room, ts, 만료 시각). 파일이 그대로면 다시 읽지 않음
+        self._ctx_cache = None
+
+    def _get_room_context(self) -> Tuple[str, str]:
+        try:
+            mtime = os.stat(self.cfg.context_file).st_mtime_ns
+            cached = self._ctx_cache
+            if cached is None or cached[0] != mtime:
+                cached = (mtime,) + read_room_context(
+                    self.cfg.context_file, self.cfg.hotkey_context_ttl_seconds
+                )
+                self._ctx_cache = cached
+
+            if time.time() <= cached[3]:
+                return cached[1], cached[2]
+        except Exception:
+            pass
+
+        return "미분류", clock.stamp()
+
+    def _process_file(self, src: str):
+        """공통 파일 처리 로직"""
+        if not os.path.exists(src):
+            return
+
+        name = os.path.basename(src)
+        _, ext = os.path.splitext(name)
+        ext_l = ext.lower()
+
+        # 무시할 확장자 체크
+        if ext_l in self.cfg.ignore_ext:
+            return
+
+        # 제외할 확장자 체크
+        if ext_l in self.cfg.exclude_extensions:
+            log_line(self.cfg, f"SKIP excluded extension: {src}")
+            return
+
+        if not wait_until_ready(src, self._ready_timeout()):
+            log_line(self.cfg, f"SKIP not-ready: {src}")
+            return
+
+        room, ts = self._get_room_context()
+        ts = ts[:12]  # YYYYMMDDHHMM (초 제거)
+
+        room = safe_name(room)
+
+        # 제외할 채팅방 체크
+        if room in self.cfg.exclude_rooms:
+            log_line(self.cfg, f"SKIP excluded room: {room}")
+            return
+
+        self._move_to_output(src, name, ext_l, room, ts)
+
+
+# 콘솔 Ctrl+C 처리기 (GC로 사라지지 않게 모듈에 붙잡아 둠)
+_console_handler = None
+STATS_PRINT_INTERVAL_SEC = 3600
+
+
+def install_stop_handler(stop_event: threading.Event) -> None:
+    """
+    Ctrl+C(콘솔 종료 키)를 누르면 stop_event를 켭니다.
+    Windows에서는 Event.wait 중에 KeyboardInterrupt가 바로 오지 않으므로
+    SetConsoleCtrlHandler로 별도 스레드에서 받아 처리합니다.
+    """
+    global _console_handler
+    if os.name == "nt":
+        HANDLER_ROUTINE = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.DWORD)
+
+        def handler(ctrl_type):
+            # 이미 종료 중이면 두 번째 Ctrl+C는 기본 동작(강제 종료)으로 넘김
+            if ctrl_type in (CTRL_C_EVENT, CTRL_BREAK_EVENT) and not stop_event.is_set():
+                stop_event.set()
+                return True
+            return False  # 창 닫기 등은 기본 동작
+
+        _console_handler = HANDLER_ROUTINE(handler)
+        kernel32.SetConsoleCtrlHandler(_console_handler, True)
+    else:
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+
+def run_until_stopped(stop_event: threading.Event, stats: Optional["Statistics"]) -> None:
+    """stop_event가 켜질 때까지 잠들어 있다가, 통계가 켜져 있으면 1시간마다 출력합니다."""
+    next_print = time.monotonic() + STATS_PRINT_INTERVAL_SEC
+    while True:
+        timeout = max(0.0, next_print - time.monotonic()) if stats else None
+        if stop_event.wait(timeout):
+            return
+        print(stats.get_today_summary())
+        next_print += STATS_PRINT_INTERVAL_SEC
 
 
 def main():
@@ -524,29 +1301,28 @@ def main():
     stats = Statistics(cfg) if cfg.enable_statistics else None
     history = History(cfg) if cfg.enable_history else None
 
+    stop_event = threading.Event()
+    install_stop_handler(stop_event)
+
     obs = Observer()
-    obs.schedule(Handler(cfg, stats, history), cfg.download_dir, recursive=False)
+    handler = Handler(cfg, stats, history)
+    obs.schedule(handler, cfg.download_dir, recursive=False)
     obs.start()
 
     try:
-        # 주기적으로 통계 출력
-        last_stats_print = time.time()
-        while True:
-            time.sleep(5)
-
-            # 1시간마다 통계 출력
-            if stats and time.time() - last_stats_print > 3600:
-                print(stats.get_today_summary())
-                last_stats_print = time.time()
-
+        run_until_stopped(stop_event, stats)
     except KeyboardInterrupt:
         pass
     finally:
         obs.stop()
         obs.join()
+        handler.stop()
 
-        # 종료 시 최종 통계 출력
+        # 종료 시 남은 기록 저장 & 최종 통계 출력
+        if history:
+            history.close()
         if stats:
+            stats.close()
             print(stats.get_today_summary())
 
         log_line(cfg, "STOP sorter")